@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from bisect import bisect_right
+from collections import Counter
 from fnmatch import fnmatch
+from itertools import groupby
 from optparse import OptionParser
+import difflib
 import inspect
+import io
+import json
 import os
 import re
+import shutil
 import sqlparse
+from sqlparse.engine import FilterStack, grouping
+from sqlparse.exceptions import SQLParseError
 import sys
+import tempfile
+import zlib
 
 __version__ = '0.5.1dev'
 
@@ -17,6 +28,7 @@ MAX_LINE_LENGTH = 79
 
 INDENT_REGEX = re.compile(r'([ \t]*)')
 RAISE_COMMA_REGEX = re.compile(r'raise\s+\w+\s*(,)')
+SHARD_REGEX = re.compile(r'^(\d+)/(\d+)$')
 SELFTEST_REGEX = re.compile(r'(Okay|[EW]\d{3}):\s(.*)')
 ERRORCODE_REGEX = re.compile(r'[EW]\d{3}')
 DOCSTRING_REGEX = re.compile(r'u?r?["\']')
@@ -25,6 +37,20 @@ WHITESPACE_AROUND_OPERATOR_REGEX = \
 EXTRANEOUS_WHITESPACE_REGEX = re.compile(r'[[({] | []}),;:]')
 WHITESPACE_AROUND_NAMED_PARAMETER_REGEX = \
     re.compile(r'[()]|\s=[^=]|[^=!<>]=\s')
+NOQA_REGEX = re.compile(
+    r'(?:--|#|/\*)\s*noqa(?P<scope>-begin|-end|-file)?'
+    r'(?::\s*(?P<codes>[EW]\d{0,3}\b(?:[\s,]+[EW]\d{0,3}\b)*))?',
+    re.IGNORECASE)
+NOQA_CODES_SEPARATOR_REGEX = re.compile(r'[\s,]+')
+# String literals and comments, to find the comments outside of strings
+LITERAL_REGEX = re.compile(r'''
+    (?P<string>'{3}(?:\\.|[^\\])*?'{3}
+      | "{3}(?:\\.|[^\\])*?"{3}
+      | '(?:''|\\.|[^\\'])*'
+      | "(?:\\.|[^\\"])*"
+      | `[^`]*`)
+  | (?P<comment>(?:--|\#)[^\n]*|/\*.*?(?:\*/|$))
+''', re.DOTALL | re.VERBOSE)
 
 KEYWORDS_STDSQL = {
     "WINDOW": sqlparse.tokens.Keyword
@@ -68,12 +94,13 @@ def tabs_obsolete(physical_line):
     editors have features that make this easy to do.
 
     >>> tabs_obsolete('\tSELECT 1')
-    (0, 'W191 indentation contains tabs')
+    (0, 'W191 indentation contains tabs', (0, 1, '    '))
     >>> tabs_obsolete('  SELECT 1')
     """
     indent = INDENT_REGEX.match(physical_line).group(1)
     if indent.count('\t'):
-        return indent.index('\t'), "W191 indentation contains tabs"
+        return (indent.index('\t'), "W191 indentation contains tabs",
+                (0, len(indent), indent.expandtabs(4)))
 
 
 def trailing_whitespace(physical_line):
@@ -92,9 +119,9 @@ def trailing_whitespace(physical_line):
     filtering for those who want to indent their blank lines.
 
     >>> trailing_whitespace('SELECT 1   ')
-    (8, 'W291 trailing whitespace')
+    (8, 'W291 trailing whitespace', (8, 11, ''))
     >>> trailing_whitespace('   ')
-    (0, 'W293 blank line contains whitespace')
+    (0, 'W293 blank line contains whitespace', (0, 3, ''))
     >>> trailing_whitespace('SELECT 1')
     >>> trailing_whitespace('')
     """
@@ -103,21 +130,33 @@ def trailing_whitespace(physical_line):
     physical_line = physical_line.rstrip('\x0c')  # chr(12), form feed, ^L
     stripped = physical_line.rstrip()
     if physical_line != stripped:
+        fix = (len(stripped), len(physical_line), '')
         if stripped:
-            return len(stripped), "W291 trailing whitespace"
+            return len(stripped), "W291 trailing whitespace", fix
         else:
-            return 0, "W293 blank line contains whitespace"
+            return 0, "W293 blank line contains whitespace", fix
 
 
 def trailing_blank_lines(physical_line, lines, line_number):
     r"""
     JCR: Trailing blank lines are superfluous.
 
-    >>> trailing_blank_lines('\n', ['SELECT 1','\n'], 2)
-    (0, 'W391 blank line at end of file')
+    The fix removes the whole run of trailing blank lines, so it starts
+    before the last line when there are several of them.
+
+    >>> trailing_blank_lines('\n', ['SELECT 1\n','\n'], 2)
+    (0, 'W391 blank line at end of file', (0, 1, ''))
+    >>> trailing_blank_lines('  \n', ['SELECT 1\n', '\n', '\n', '  \n'], 4)
+    (0, 'W391 blank line at end of file', (-2, 3, ''))
     """
     if physical_line.strip() == '' and line_number == len(lines):
-        return 0, "W391 blank line at end of file"
+        start = 0
+        for line in reversed(lines[:line_number - 1]):
+            if line.strip():
+                break
+            start -= len(line)
+        return (0, "W391 blank line at end of file",
+                (start, len(physical_line), ''))
 
 
 def missing_newline(physical_line):
@@ -125,10 +164,13 @@ def missing_newline(physical_line):
 
     >>> missing_newline('SELECT 1\n')
     >>> missing_newline('SELECT 1')
-    (8, 'W292 no newline at end of file')
+    (8, 'W292 no newline at end of file', (8, 8, '\n'))
+    >>> missing_newline('SELECT 1  ')
+    (10, 'W292 no newline at end of file', (10, 10, '\n'))
     """
-    if physical_line.rstrip() == physical_line:
-        return len(physical_line), "W292 no newline at end of file"
+    if not physical_line.endswith(('\n', '\r')):
+        return (len(physical_line), "W292 no newline at end of file",
+                (len(physical_line), len(physical_line), '\n'))
 
 
 def maximum_line_length(physical_line):
@@ -165,14 +207,14 @@ def dont_use_hypen_comment(physical_line):
         pass
 
 
-<<<<<<< HEAD:bqlint.py
 ##############################################################################
 # Plugins (check functions) for tokens
 ##############################################################################
 
 def use_upper_case_keyword(token: sqlparse.sql.Token, offset):
     if token.is_keyword and not token.value.isupper():
-        return offset, f"W000 Use upper case for keyword `{token}`"
+        return (offset, f"W000 Use upper case for keyword `{token}`",
+                (offset, offset + len(token.value), token.value.upper()))
 
 
 def use_explicit_alias(token: sqlparse.sql.Token, offset):
@@ -193,13 +235,9 @@ def use_explicit_alias(token: sqlparse.sql.Token, offset):
             return offset, f"W000 Alias needs keywords"
 
 
-
 ##############################################################################
-=======
-#
->>>>>>> pr-1:bqlint/bqlint.py
 # Framework to run all checks
-#
+##############################################################################
 
 def find_checks(argument_name):
     """
@@ -219,9 +257,122 @@ def find_checks(argument_name):
     return checks
 
 
-<<<<<<< HEAD:bqlint.py
-class Checker():
-=======
+def line_tokens(lines, silenced=lambda line_number: False):
+    r"""
+    Tokenize the lines which are not silenced, statement by statement, so
+    that string literals and comments spanning several lines keep their
+    meaning, and return for each line the (token, offset) pairs of the
+    tokens starting on it.
+
+    >>> tokens = line_tokens(["select 'a\n", "select b from t' as x\n"])
+    >>> [[str(token) for token, offset in line if token.is_keyword]
+    ...  for line in tokens]
+    [['select'], ['as']]
+    >>> [offset for token, offset in tokens[1]]
+    [16, 17, 19, 20, 21]
+
+    Silenced lines are not parsed, except for a literal running into the
+    lines which are not.
+
+    >>> tokens = line_tokens(["select 1\n", "select 'a\n", "from' as x\n"],
+    ...                      lambda line_number: line_number < 3)
+    >>> [[str(token) for token, offset in line if token.is_keyword]
+    ...  for line in tokens]
+    [[], [], ['as']]
+
+    A statement too big for sqlparse is tokenized line by line instead,
+    leaving out the lines which start within a literal.
+
+    >>> lines = (['select x from t\n', 'where x in (\n'] +
+    ...          ['  %d,\n' % number for number in range(6000)] +
+    ...          ["  'a\n", "  from')\n", 'select 1\n'])
+    >>> tokens = line_tokens(lines)
+    >>> [[str(token) for token, offset in line if token.is_keyword]
+    ...  for line in tokens[:2] + tokens[-3:]]
+    [['select', 'from'], ['where', 'in'], [], [], ['select']]
+    """
+    starts = []
+    position = 0
+    for line in lines:
+        starts.append(position)
+        position += len(line)
+    starts.append(position)
+    source = ''.join(lines)
+    tokens = [[] for line in lines]
+
+    def add(token, position):
+        index = bisect_right(starts, position) - 1
+        tokens[index].append((token, position - starts[index]))
+
+    # Spans of source positions covering the lines which are not silenced
+    spans = []
+    for line_number in range(1, len(lines) + 1):
+        if silenced(line_number):
+            continue
+        if spans and spans[-1][1] == starts[line_number - 1]:
+            spans[-1][1] = starts[line_number]
+        else:
+            spans.append([starts[line_number - 1], starts[line_number]])
+    if spans[:1] != [[0, len(source)]]:
+        # Start the spans running into a literal at the start of the literal
+        literals = LITERAL_REGEX.finditer(source)
+        literal = next(literals, None)
+        merged = []
+        for span in spans:
+            while literal is not None and literal.end() <= span[0]:
+                literal = next(literals, None)
+            if literal is not None and literal.start() < span[0]:
+                span[0] = literal.start()
+            if merged and span[0] <= merged[-1][1]:
+                merged[-1][1] = span[1]
+            else:
+                merged.append(span)
+        spans = merged
+
+    for position, end in spans:
+        for statement in FilterStack().run(source[position:end]):
+            leaves = list(statement.flatten())
+            try:
+                grouping.group(statement)
+            except SQLParseError:
+                tokenize_lines(leaves, position, add)
+            else:
+                for token in statement.flatten():
+                    add(token, position)
+                    position += len(token.value)
+                continue
+            position += sum(len(token.value) for token in leaves)
+    return tokens
+
+
+def tokenize_lines(leaves, position, add):
+    """
+    Tokenize the lines of the ungrouped tokens leaves, found at position
+    in the source, each line on its own.  Lines starting within a literal
+    are left out.
+    """
+    text = ''.join(token.value for token in leaves)
+    literals = []
+    offset = 0
+    for token in leaves:
+        if '\n' in token.value and not token.is_whitespace:
+            literals.append((offset, offset + len(token.value)))
+        offset += len(token.value)
+    offset = 0
+    for line in io.StringIO(text, newline='').readlines():
+        if not any(start < offset < end for start, end in literals):
+            try:
+                statements = sqlparse.parse(line)
+            except SQLParseError:
+                statements = ()
+            line_offset = offset
+            for statement in statements:
+                for token in statement.flatten():
+                    add(token, position + line_offset)
+                    line_offset += len(token.value)
+        offset += len(line)
+
+
 def message(args):
     """
     Temporary function to pass pep8 check
@@ -229,15 +380,140 @@ def message(args):
     pass
 
 
+class NoqaIndex(object):
+    r"""
+    Interval index of the lines silenced by ``noqa`` comments.
+
+    ``-- noqa`` silences its own line, ``-- noqa-begin`` ... ``-- noqa-end``
+    silences a block of lines and ``-- noqa-file`` the whole file.  Any of
+    them can be restricted to some codes, e.g. ``# noqa: W291,E5``.
+    Only real comments count, not ``noqa`` within a string literal.
+
+    >>> index = NoqaIndex(['SELECT 1  -- noqa\n', 'SELECT 2  # noqa: W2\n',
+    ...                    '-- noqa-begin\n', 'SELECT 3\n', '-- noqa-end\n',
+    ...                    'SELECT 4\n'])
+    >>> index.silenced(1), index.silenced(2), index.silenced(4)
+    (True, False, True)
+    >>> index.ignores(2, 'W291'), index.ignores(2, 'E501')
+    (True, False)
+    >>> index.silenced(6), index.ignores(6, 'W291')
+    (False, False)
+
+    >>> index = NoqaIndex(["SELECT '-- noqa' AS x   \n",
+    ...                    "SELECT 'a\n", "# noqa' -- noqa: W291 W293\n"])
+    >>> index.silenced(1), index.silenced(2), index.silenced(3)
+    (False, False, False)
+    >>> index.ignores(3, 'W291'), index.ignores(3, 'W293')
+    (True, True)
+    """
+
+    def __init__(self, lines):
+        intervals = []
+        blocks = []
+        source = ''.join(lines)
+        line_number, position = 1, 0
+        for literal in LITERAL_REGEX.finditer(source):
+            if literal.lastgroup != 'comment':
+                continue
+            match = NOQA_REGEX.match(literal.group())
+            if match is None:
+                continue
+            line_number += source.count('\n', position, literal.start())
+            position = literal.start()
+            scope, codes = match.group('scope', 'codes')
+            if codes:
+                codes = frozenset(
+                    code.upper() for code in
+                    NOQA_CODES_SEPARATOR_REGEX.split(codes))
+            else:
+                # The empty prefix matches every code, as in options.ignore
+                codes = frozenset([''])
+            scope = (scope or '').lower()
+            if scope == '-begin':
+                blocks.append((line_number, codes))
+            elif scope == '-end':
+                if blocks:
+                    start, codes = blocks.pop()
+                    intervals.append((start, line_number, codes))
+            elif scope == '-file':
+                intervals.append((1, len(lines), codes))
+            else:
+                intervals.append((line_number, line_number, codes))
+        # A block which is never closed runs up to the end of the file
+        for start, codes in blocks:
+            intervals.append((start, len(lines), codes))
+        self.starts, self.ends, self.codes = self.build(intervals)
+
+    @staticmethod
+    def build(intervals):
+        """
+        Flatten possibly overlapping intervals into sorted disjoint segments,
+        each one carrying the union of the codes silenced on its lines.
+
+        >>> starts, ends, codes = NoqaIndex.build([
+        ...     (1, 4, frozenset(['W2'])), (3, 6, frozenset(['E5'])),
+        ...     (5, 5, frozenset(['W2'])), (9, 9, frozenset(['']))])
+        >>> starts, ends, [sorted(prefixes) for prefixes in codes]
+        ([1, 3, 6, 9], [2, 5, 6, 9], [['W2'], ['E5', 'W2'], ['E5'], ['']])
+        """
+        events = sorted(
+            (event for start, end, codes in intervals
+             for event in ((start, 1, codes), (end + 1, -1, codes))),
+            key=lambda event: event[0])
+        active = Counter()
+        codes = frozenset()
+        starts, ends, segment_codes = [], [], []
+        previous = None
+        for position, group in groupby(events, key=lambda event: event[0]):
+            if codes:
+                # Close the segment running since the previous event
+                if ends and ends[-1] == previous - 1 \
+                        and segment_codes[-1] == codes:
+                    ends[-1] = position - 1
+                else:
+                    starts.append(previous)
+                    ends.append(position - 1)
+                    segment_codes.append(codes)
+            for _, delta, interval_codes in group:
+                active[interval_codes] += delta
+                if not active[interval_codes]:
+                    del active[interval_codes]
+            codes = frozenset().union(*active)
+            previous = position
+        return starts, ends, segment_codes
+
+    def lookup(self, line_number):
+        """
+        Return the code prefixes silenced on line_number.
+        """
+        index = bisect_right(self.starts, line_number) - 1
+        if index >= 0 and line_number <= self.ends[index]:
+            return self.codes[index]
+        return frozenset()
+
+    def silenced(self, line_number):
+        """
+        Check if every code is silenced on line_number.
+        """
+        return '' in self.lookup(line_number)
+
+    def ignores(self, line_number, code):
+        """
+        Check if code is silenced on line_number.
+        """
+        return any(code.startswith(prefix)
+                   for prefix in self.lookup(line_number))
+
+
 class Checker(object):
     """
-    Load a Python source file, tokenize it, check coding style.
+    Load a SQL source file, tokenize it, check coding style.
     """
->>>>>>> pr-1:bqlint/bqlint.py
 
     def __init__(self, file_path):
         self.file_path = file_path if file_path else None
-
+        self.file_errors = 0
+        self.diagnostics = []
 
     def check_physical(self, line):
         """
@@ -248,183 +524,175 @@ class Checker(object):
         for name, check, argument_names in options.physical_checks:
             result = self.run_check(check, argument_names)
             if result is not None:
-                offset, text = result
-                self.report_error(self.line_number, offset, text, check)
-
-<<<<<<< HEAD:bqlint.py
+                offset, text = result[:2]
+                fix = result[2] if len(result) > 2 else None
+                self.report_error(self.line_number, offset, text, check, fix)
 
     def check_token(self, token, offset):
-=======
-    def build_tokens_line(self):
-        """
-        Build a logical line from tokens.
         """
-        pass
-        # self.mapping = []
-        # logical = []
-        # length = 0
-        # previous = None
-        # for token in self.tokens:
-        #     token_type, text = token[0:2]
-        #     if token_type in SKIP_TOKENS:
-        #         continue
-        #     if token_type == tokenize.STRING:
-        #         text = mute_string(text)
-        #     if previous:
-        #         end_line, end = previous[3]
-        #         start_line, start = token[2]
-        #         if end_line != start_line:  # different row
-        #             prev_text = self.lines[end_line - 1][end - 1]
-        #             if prev_text == ',' or (prev_text not in '{[('
-        #                                     and text not in '}])'):
-        #                 logical.append(' ')
-        #                 length += 1
-        #         elif end != start:  # different column
-        #             fill = self.lines[end_line - 1][end:start]
-        #             logical.append(fill)
-        #             length += len(fill)
-        #     self.mapping.append((length, token))
-        #     logical.append(text)
-        #     length += len(text)
-        #     previous = token
-        # self.logical_line = ''.join(logical)
-        # assert self.logical_line.lstrip() == self.logical_line
-        # assert self.logical_line.rstrip() == self.logical_line
-
-    def check_logical(self):
->>>>>>> pr-1:bqlint/bqlint.py
-        """
-        Run all physical checks on a raw input line.
+        Run all token checks on a token of the current line.
         """
-<<<<<<< HEAD:bqlint.py
         self.token = token
         self.offset = offset
         for name, check, argument_names in options.token_checks:
-=======
-        options.counters['logical lines'] += 1
-        self.build_tokens_line()
-        # first_line = self.lines[self.mapping[0][1][2][0] - 1]
-        # indent = first_line[:self.mapping[0][1][2][1]]
-        self.previous_indent_level = self.indent_level
-        # self.indent_level = expand_indent(indent)
-        if options.verbose >= 2:
-            print(self.logical_line[:80].rstrip())
-        for name, check, argument_names in options.logical_checks:
-            if options.verbose >= 4:
-                print('   ' + name)
->>>>>>> pr-1:bqlint/bqlint.py
             result = self.run_check(check, argument_names)
             if result is not None:
-                offset, text = result
-                self.report_error(self.line_number, offset, text, check)
-
+                offset, text = result[:2]
+                fix = result[2] if len(result) > 2 else None
+                self.report_error(self.line_number, offset, text, check, fix)
 
     def run_check(self, check, argument_names):
         """
         Run a check plugin.
         """
-<<<<<<< HEAD:bqlint.py
         arguments = []
         for name in argument_names:
             arguments.append(getattr(self, name))
         return check(*arguments)
 
-
     def run(self):
-        tokens = []
-        with open(self.file_path) as fin:
+        """
+        Run all checks on the input file.
+        """
+        # Keep the line endings untouched, fixes are written back as is
+        with open(self.file_path, newline='') as fin:
             self.lines = fin.readlines()
-
-        for line_number, line in enumerate(self.lines):
-            self.line_number = line_number
+        self.noqa = NoqaIndex(self.lines)
+        self.edits = []
+
+        line_numbers = range(1, len(self.lines) + 1)
+        if all(self.noqa.silenced(number) for number in line_numbers):
+            return self.file_errors
+        tokens = line_tokens(self.lines, self.noqa.silenced)
+
+        self.line_start = 0
+        for self.line_number, line in enumerate(self.lines, 1):
+            if self.line_number > 1:
+                self.line_start += len(self.lines[self.line_number - 2])
+            if self.noqa.silenced(self.line_number):
+                continue
             self.check_physical(line)
-
-            offset = 0
-            tokens = sqlparse.parse(line)[0].flatten()
-            for token in tokens:
+            for token, offset in tokens[self.line_number - 1]:
                 self.check_token(token, offset)
-                offset += len(str(token))
-=======
-        self.expected = expected or ()
-        self.line_offset = line_offset
-        self.line_number = 0
-        self.file_errors = 0
-        self.indent_char = None
-        self.indent_level = 0
-        self.previous_logical = ''
-        self.blank_lines = 0
-        self.blank_lines_before_comment = 0
-        self.tokens = []
-        # parens = 0
-        for line in self.readline():
-            self.check_physical(line)
-            # token = sqlparse.split(line)
-
-            # self.tokens.append(token)
-            # token_type, text = token, str(token)
-            # if token_type == tokenize.OP and text in '([{':
-            #     parens += 1
-            # if token_type == tokenize.OP and text in '}])':
-            #     parens -= 1
-            # if token_type == tokenize.NEWLINE and not parens:
-            #     self.check_logical()
-            #     self.blank_lines = 0
-            #     self.blank_lines_before_comment = 0
-            #     self.tokens = []
-            # if token_type == tokenize.NL and not parens:
-            #     if len(self.tokens) <= 1:
-            #         # The physical line contains only this token.
-            #         self.blank_lines += 1
-            #     self.tokens = []
-            # if token_type == tokenize.COMMENT:
-            #     source_line = token[4]
-            #     token_start = token[2][1]
-            #     if source_line[:token_start].strip() == '':
-            #         self.blank_lines_before_comment = max(self.blank_lines,
-            #             self.blank_lines_before_comment)
-            #         self.blank_lines = 0
-            #     if text.endswith('\n') and not parens:
-            # The comment also ends a physical line.  This works around
-            # Python < 2.6 behaviour, which does not generate NL after
-            # a comment which is on a line by itself.
-            #         self.tokens = []
+        if self.edits:
+            self.apply_fixes()
         return self.file_errors
->>>>>>> pr-1:bqlint/bqlint.py
 
-    def report_error(self, line_number, offset, text, check):
+    def apply_fixes(self):
         """
-        Report an error, according to options.
+        Apply the collected fixes in a single rewrite of the file, or show
+        them as a unified diff.  Conflicting fixes are left for a next run.
         """
-<<<<<<< HEAD:bqlint.py
-        print(err_format.format(
-            path=self.file_path, line=line_number, column=offset,
-            type=text[0], message=text
-        ))
+        edits, conflicts = merge_edits(self.edits)
+        if conflicts:
+            sys.stderr.write('%s: %d conflicting fix(es) left for a next run\n'
+                             % (self.file_path, len(conflicts)))
+        fixed = apply_edits(''.join(self.lines), edits)
+        if options.diff:
+            diff = difflib.unified_diff(
+                self.lines, io.StringIO(fixed, newline='').readlines(),
+                self.file_path, self.file_path)
+            for line in diff:
+                sys.stdout.write(line)
+                if not line.endswith('\n'):
+                    sys.stdout.write('\n\\ No newline at end of file\n')
+        else:
+            write_atomic(self.file_path, fixed)
 
-=======
+    def report_error(self, line_number, offset, text, check, fix=None):
+        """
+        Report an error, according to options, and collect its fix.
+        """
         code = text[:4]
-        if ignore_code(code):
+        if ignore_code(code) or self.noqa.ignores(line_number, code):
             return
         if options.quiet == 1 and not self.file_errors:
-            message(self.filename)
+            message(self.file_path)
         if code in options.counters:
             options.counters[code] += 1
         else:
             options.counters[code] = 1
             options.messages[code] = text[5:]
-        if options.quiet or code in self.expected:
-            # Don't care about expected errors or warnings
+        self.diagnostics.append((line_number, offset + 1, text))
+        if fix is not None and (options.fix or options.diff):
+            start, end, replacement = fix
+            self.edits.append((self.line_start + start,
+                               self.line_start + end, replacement))
+        if options.quiet:
             return
         self.file_errors += 1
         if options.counters[code] == 1 or options.repeat:
             print(err_format.format(
-                path=self.filename,
-                line=self.line_offset + line_number,
+                path=self.file_path,
+                line=line_number,
                 column=offset + 1,
-                type='E',
+                type=text[0],
                 message=text
             ))
->>>>>>> pr-1:bqlint/bqlint.py
+
+
+def merge_edits(edits):
+    r"""
+    Sort edits by position and split off the ones conflicting with an edit
+    kept before them.  An edit is a (start, end, replacement) triple.  A
+    deletion within a wider deletion is merged into it, not a conflict.
+
+    >>> merge_edits([(8, 11, ''), (0, 6, 'SELECT'), (9, 12, 'x'),
+    ...              (11, 11, '\n'), (8, 11, '')])
+    ([(0, 6, 'SELECT'), (8, 11, ''), (11, 11, '\n')], [(9, 12, 'x')])
+    >>> merge_edits([(10, 12, ''), (9, 13, ''), (11, 13, 'x')])
+    ([(9, 13, '')], [(11, 13, 'x')])
+    """
+    merged, conflicts = [], []
+    for edit in sorted(set(edits), key=lambda edit: (edit[0], -edit[1])):
+        start, end, replacement = edit
+        if not merged:
+            merged.append(edit)
+            continue
+        previous_start, previous_end, previous_replacement = merged[-1]
+        if start < previous_end or start == end == previous_start:
+            if replacement or previous_replacement or end > previous_end:
+                conflicts.append(edit)
+        else:
+            merged.append(edit)
+    return merged, conflicts
+
+
+def apply_edits(source, edits):
+    r"""
+    Apply sorted, non overlapping edits to source in a single pass.
+
+    >>> apply_edits('select 1  ', [(0, 6, 'SELECT'), (8, 10, ''),
+    ...                            (10, 10, '\n')])
+    'SELECT 1\n'
+    """
+    chunks = []
+    position = 0
+    for start, end, replacement in edits:
+        chunks.append(source[position:start])
+        chunks.append(replacement)
+        position = end
+    chunks.append(source[position:])
+    return ''.join(chunks)
+
+
+def write_atomic(filename, text):
+    """
+    Replace the content of filename with text, so that the file is never
+    seen half written.
+    """
+    # Replace the target of a symbolic link, not the link itself
+    filename = os.path.realpath(filename)
+    dirname, basename = os.path.split(filename)
+    fd, temp_path = tempfile.mkstemp(prefix='.' + basename + '.', dir=dirname)
+    try:
+        with os.fdopen(fd, 'w', newline='') as fout:
+            fout.write(text)
+        shutil.copymode(filename, temp_path)
+        os.replace(temp_path, filename)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
 
 def input_file(filename):
@@ -436,6 +704,170 @@ def input_file(filename):
     errors = Checker(filename).run()
 
 
+def input_shard(paths, result_file):
+    """
+    Check the files of this shard (see shard_files) and write the
+    diagnostics and statistics to result_file, to be merged later.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            input_dir(path, runner=filenames.append)
+        elif not excluded(path):
+            filenames.append(path)
+    index, count = options.shard
+    results = []
+    for position, filename in shard_files(filenames, index, count):
+        if options.verbose:
+            message('checking ' + filename)
+        checker = Checker(filename)
+        checker.run()
+        results.append((position, filename, checker.diagnostics))
+    options.counters['files'] = len(results)
+    # Every shard walks the whole tree, count directories only once
+    if index:
+        options.counters['directories'] = 0
+    with open(result_file, 'w') as fout:
+        json.dump({
+            'version': __version__,
+            'shard': [index, count],
+            'counters': options.counters,
+            'files': results,
+        }, fout, separators=(',', ':'))
+
+
+def shard_files(filenames, index, count, weights=None):
+    """
+    Return the (position, filename) pairs of the files assigned to shard
+    index out of count, position being the rank in filenames.
+
+    The biggest files are placed first, each one on the least loaded shard;
+    ties are broken by hashing the file name, so that every node computes
+    the same assignment from the same tree.  weights defaults to the file
+    sizes.
+
+    >>> filenames = ['a.sql', 'b.sql', 'c.sql', 'd.sql', 'e.sql', 'f.sql']
+    >>> weights = [50, 10, 40, 20, 30, 10]
+    >>> shards = [shard_files(filenames, index, 2, weights)
+    ...           for index in range(2)]
+    >>> shards
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [[(0, 'a.sql'), (1, 'b.sql'), (3, 'd.sql')],
+     [(2, 'c.sql'), (4, 'e.sql'), (5, 'f.sql')]]
+    >>> shards == [shard_files(filenames, index, 2, weights)
+    ...            for index in range(2)]
+    True
+    >>> [sum(weights[position] for position, filename in shard)
+    ...  for shard in shards]
+    [80, 80]
+    """
+    if weights is None:
+        weights = [os.path.getsize(filename) + 1 for filename in filenames]
+    loads = [0] * count
+    positions = []
+    for position in sorted(range(len(filenames)),
+                           key=lambda i: (-weights[i], filenames[i])):
+        key = filenames[position].encode('utf-8')
+        shard = min(range(count), key=lambda i: (
+            loads[i], zlib.crc32(key, i)))
+        loads[shard] += weights[position]
+        if shard == index:
+            positions.append(position)
+    return [(position, filenames[position]) for position in sorted(positions)]
+
+
+def merge_results(result_files):
+    r"""
+    Merge the result files of all the shards, then report the errors and
+    update the statistics as a single run over the whole tree would.
+
+    >>> import contextlib, shutil, tempfile
+    >>> tree, results = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> for name, source in [('a.sql', 'select 1  \n'),
+    ...                      ('b.sql', "SELECT 'x'\n\tselect 2\n"),
+    ...                      ('c.sql', 'select 3\n\n'), ('d.sql', '')]:
+    ...     with open(os.path.join(tree, name), 'w') as fout:
+    ...         _ = fout.write(source)
+    >>> def run(*arglist):
+    ...     output = io.StringIO()
+    ...     with contextlib.redirect_stdout(output):
+    ...         try:
+    ...             _main(list(arglist))
+    ...         except SystemExit as exit:
+    ...             return output.getvalue(), exit.code
+    ...     return output.getvalue(), 0
+    >>> single = run('-r', '--statistics', '--filename=*.sql', tree)
+    >>> result_files = [os.path.join(results, '%d.json' % index)
+    ...                 for index in range(3)]
+    >>> for index, result_file in enumerate(result_files):
+    ...     _ = run('-r', '--filename=*.sql', '--shard=%d/3' % index,
+    ...             '--result-file=' + result_file, tree)
+    >>> run('merge', '-r', '--statistics', *result_files) == single
+    True
+    >>> print(single[0].replace(tree + os.sep, ''))
+    a.sql:1:9:W W291 trailing whitespace
+    a.sql:1:1:W W000 Use upper case for keyword `select`
+    b.sql:2:1:W W191 indentation contains tabs
+    b.sql:2:1:E E101 indentation contains mixed spaces and tabs
+    b.sql:2:2:W W000 Use upper case for keyword `select`
+    c.sql:1:1:W W000 Use upper case for keyword `select`
+    c.sql:2:1:W W391 blank line at end of file
+    1       E101 indentation contains mixed spaces and tabs
+    3       W000 Use upper case for keyword `select`
+    1       W191 indentation contains tabs
+    1       W291 trailing whitespace
+    1       W391 blank line at end of file
+    <BLANKLINE>
+    >>> single[1]
+    1
+    >>> run('merge', *result_files[:1] * 2 + result_files[1:])[1]
+    ... # doctest: +ELLIPSIS
+    '...: the results of shard 0 are given twice'
+    >>> run('merge', *result_files[:2])[1]  # doctest: +ELLIPSIS
+    '...: expected the results of every shard exactly once'
+    >>> shutil.rmtree(tree), shutil.rmtree(results)
+    (None, None)
+    """
+    results = []
+    indexes, counts, versions = set(), set(), set()
+    for result_file in result_files:
+        with open(result_file) as fin:
+            result = json.load(fin)
+        index, count = result['shard']
+        if index in indexes:
+            sys.exit('%s: the results of shard %d are given twice' %
+                     (options.prog, index))
+        indexes.add(index)
+        counts.add(count)
+        versions.add(result['version'])
+        for key, value in result['counters'].items():
+            options.counters[key] = options.counters.get(key, 0) + value
+        results.extend(result['files'])
+    if len(versions) > 1:
+        sys.exit('%s: the results come from different versions: %s' %
+                 (options.prog, ', '.join(sorted(versions))))
+    if len(counts) != 1 or indexes != set(range(counts.pop())):
+        sys.exit('%s: expected the results of every shard exactly once' %
+                 options.prog)
+    results.sort()
+    reported = set()
+    for position, filename, diagnostics in results:
+        for line_number, column, text in diagnostics:
+            code = text[:4]
+            options.messages.setdefault(code, text[5:])
+            if options.quiet:
+                continue
+            if code not in reported or options.repeat:
+                print(err_format.format(
+                    path=filename,
+                    line=line_number,
+                    column=column,
+                    type=text[0],
+                    message=text
+                ))
+            reported.add(code)
+
+
 def input_dir(dirname, runner=None):
     """
     Check all Python source files in this directory and all subdirectories.
@@ -509,13 +941,22 @@ def get_count(prefix=''):
     return count
 
 
+def print_statistics(prefix=''):
+    """Print overall statistics (number of errors and warnings)."""
+    for key in sorted(options.messages):
+        if key.startswith(prefix):
+            print('%-7s %s %s' %
+                  (options.counters[key], key, options.messages[key]))
+
+
 def process_options(arglist=None):
     """
     Process options passed either via arglist or via command line args.
     """
     global options, args
     parser = OptionParser(version=__version__,
-                          usage="%prog [options] input ...")
+                          usage="%prog [options] input ...\n"
+                          "       %prog merge [options] result ...")
     parser.add_option('-v', '--verbose', default=0, action='count',
                       help="print status messages, or debug with -vv")
     parser.add_option('-q', '--quiet', default=0, action='count',
@@ -538,6 +979,19 @@ def process_options(arglist=None):
                       help="show source code for each error")
     parser.add_option('--show-pep8', action='store_true',
                       help="show text of PEP 8 for each error")
+    parser.add_option('--fix', action='store_true',
+                      help="fix the errors and warnings which can be fixed "
+                      "automatically, rewriting the files in place")
+    parser.add_option('--diff', action='store_true',
+                      help="show the automatic fixes as a unified diff "
+                      "instead of applying them")
+    parser.add_option('--shard', metavar='index/count',
+                      help="only check the files of shard index (from 0) "
+                      "out of count, and write the results to be merged "
+                      "with `%prog merge`")
+    parser.add_option('--result-file', metavar='file',
+                      help="where to write the results of the shard "
+                      "(default: bqlint-shard-INDEX.json)")
     parser.add_option('--statistics', action='store_true',
                       help="count errors and warnings")
     parser.add_option('--count', action='store_true',
@@ -559,6 +1013,13 @@ def process_options(arglist=None):
     options.exclude = options.exclude.split(',')
     for index in range(len(options.exclude)):
         options.exclude[index] = options.exclude[index].rstrip('/')
+    if options.shard:
+        match = SHARD_REGEX.match(options.shard)
+        if not match or int(match.group(1)) >= int(match.group(2)):
+            parser.error('--shard expects index/count with index < count')
+        options.shard = int(match.group(1)), int(match.group(2))
+        if not options.result_file:
+            options.result_file = 'bqlint-shard-%d.json' % options.shard[0]
     if options.filename:
         options.filename = options.filename.split(',')
     if options.select:
@@ -588,24 +1049,35 @@ def readlines(filename):
     return open(filename, encoding='latin-1').readlines()
 
 
-def _main():
+def _main(arglist=None):
     """
     Parse options and run checks on Python source.
     """
-    options, args = process_options()
-    if options.doctest:
-        import doctest
-        doctest.testmod(verbose=options.verbose)
-        # selftest()
-    runner = input_file
-
-    for path in args:
-        if os.path.isdir(path):
-            input_dir(path, runner=runner)
-        elif not excluded(path):
-            options.counters['files'] += 1
-            runner(path)
+    if arglist is None:
+        arglist = sys.argv[1:]
+    if arglist[:1] == ['merge']:
+        options, args = process_options(arglist[1:])
+        merge_results(args)
+    else:
+        options, args = process_options(arglist)
+        if options.doctest:
+            import doctest
+            doctest.testmod(verbose=options.verbose)
+            # selftest()
+        runner = input_file
 
+        if options.shard:
+            input_shard(args, options.result_file)
+        else:
+            for path in args:
+                if os.path.isdir(path):
+                    input_dir(path, runner=runner)
+                elif not excluded(path):
+                    options.counters['files'] += 1
+                    runner(path)
+
+    if options.statistics:
+        print_statistics()
     count = get_count()
     if count:
         if options.count: